@@ -0,0 +1,334 @@
+"""Офлайн-бенчмарк краулера.
+
+Прогоняет полный путь краулера (JWWatcher.main: параллельно по языкам из --languages get_journals_list ->
+parse_journal_issues -> check_journal_issue_availability -> form_telegraph_page -> загрузка изображений -> скачивание
+аудио) против локального сервера, который отдаёт записанные страницы jw.org (test_page.html и ./fixtures), и
+фейкового Telegraph. Время разбора страниц считается отдельно для каждого парсера
+BeautifulSoup. Результаты сохраняются в JSON, чтобы сравнивать прогоны между собой:
+
+    python benchmark.py --output bench_results.json
+    python benchmark.py --compare bench_results.json --max-regression 10
+
+fixtures/article.html -- копия error_content.html, а не ссылка на него: export_article_to_telegraph перезаписывает
+error_content.html, когда Telegraph не принимает тег (NotAllowedTag), и статья бенчмарка менялась бы от прогона к
+прогону.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import re
+import resource
+import tempfile
+import time
+from datetime import datetime
+from functools import partial
+from hashlib import sha1
+from pathlib import Path
+from string import Template
+from typing import Dict, List
+from urllib.parse import quote
+
+from aiohttp import web
+from bs4 import BeautifulSoup
+from prometheus_client import REGISTRY
+
+import common_functions
+import jw_watcher
+from bench_utils import percentile, git_revision
+from locales import LOCALES
+from models import db, init_db, Article, Journal, JournalIssue
+
+ROOT_DIR = Path(__file__).parent
+FIXTURES_DIR = ROOT_DIR / 'fixtures'
+ISSUE_PAGES = {'ru': ROOT_DIR / 'test_page.html', 'en': FIXTURES_DIR / 'issue_en.html'}
+NUMBERED_SYMBOLS = ('wp', 'g')
+ASSETS_HOST = 'https://assetsnffrgf-a.akamaihd.net'
+WRITE_QUERY_KINDS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# метрики, рост которых считается регрессией (для остальных регрессия -- падение)
+LOWER_IS_BETTER = ('peak_rss_mb', 'wall_time_s')
+LOWER_IS_BETTER_SUFFIXES = ('_p50_ms', '_p99_ms')
+
+logger = logging.getLogger('jw_benchmark')
+
+
+class IssueFixture:
+    """Записанная страница выпуска одного языка: адреса статей и дата в заголовке подменяются под запрос."""
+
+    def __init__(self, path: Path):
+        self.page = path.read_text()
+        soup = BeautifulSoup(self.page, 'lxml')
+        article_hrefs = [item.find('a')['href'] for item in soup.find_all('div', {'class': 'PublicationArticle'})]
+        self.article_prefix = article_hrefs[0].rstrip('/').rsplit('/', 1)[0] + '/'
+        self.date = re.search(r'\S+\s\d{4}', soup.find('h1').text.strip()).group(0)
+
+
+class FixtureServer:
+    """Отдаёт записанные страницы так, как их отдавал бы jw.org: список журналов, выпуски, статьи, аудио и
+    изображения на каждом языке из ISSUE_PAGES. Чтобы в базе не было конфликтов уникальности, номер выпуска и
+    заголовок статьи подставляются из пути запроса, а к адресам статей добавляется номер выпуска -- так у каждой
+    статьи свой аудиофайл. Выпуски журналов из NUMBERED_SYMBOLS озаглавлены номером («№ 1 2022 | ...»), остальные --
+    месяцем, так что проверяются оба разбора заголовка.
+
+    В каждую статью вставляется images_per_article изображений со своими адресами; у первых shared_images из них
+    содержимое одинаково во всех статьях -- так проверяется дедупликация загрузок по хэшу содержимого.
+    """
+
+    def __init__(self, years: List[int], issues_per_year: int, audio_size: int, image_size: int,
+                 images_per_article: int, shared_images: int):
+        self.years = years
+        self.issues_per_year = issues_per_year
+        self.images_per_article = images_per_article
+        self.shared_images = shared_images
+        self.audio = b'\0' * audio_size
+        self.image_size = image_size
+        self.requests: Dict[str, int] = {}
+        self.base_url = ''
+
+        self.list_template = Template((FIXTURES_DIR / 'journals_list.html').read_text())
+        self.issue_pages = {language: IssueFixture(path) for language, path in ISSUE_PAGES.items()}
+        self.article_page = (FIXTURES_DIR / 'article.html').read_text()
+
+    def _count(self, kind: str):
+        self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    async def journals_list(self, language: str, request: web.Request) -> web.Response:
+        self._count('list')
+        symbol = request.query.get('pubFilter')
+        year = request.query.get('yearFilter')
+        publications = []
+        if symbol and year and int(year) in self.years:  # краулер перебирает все годы с 2001-го
+            for number in range(1, self.issues_per_year + 1):
+                href = f"/{language}/fixture/issue/{symbol}/{year}/{number}/"
+                publications.append(f'<div class="publicationDesc"><h3><a href="{href}">{number}</a></h3></div>')
+        years = '\n'.join(f'<option value="{year}">{year}</option>' for year in self.years)
+        page = self.list_template.substitute(years=years, publications='\n'.join(publications))
+        return web.Response(text=page, content_type='text/html')
+
+    async def issue(self, request: web.Request) -> web.Response:
+        self._count('issue')
+        language, symbol, year, number = (request.match_info[key] for key in ('language', 'symbol', 'year', 'number'))
+        locale, fixture = LOCALES[language], self.issue_pages[language]
+        if symbol in NUMBERED_SYMBOLS:
+            heading = f"{locale.issue_number_prefix} {number} {year} | {symbol} {year} {number}"
+        else:
+            heading = f"{locale.months[(int(number) - 1) % 12].capitalize()} {year}"
+        page = fixture.page.replace(fixture.date, heading)
+        page = page.replace(fixture.article_prefix,
+                            f"/{language}/fixture/article/{symbol}/{year}/{number}/{symbol}-{year}-{number}-")
+        return web.Response(text=page, content_type='text/html')
+
+    async def article(self, request: web.Request) -> web.Response:
+        self._count('article')
+        key = '/'.join(request.match_info[key] for key in ('language', 'symbol', 'year', 'number', 'slug'))
+        page = re.sub(r'(<h1 id="p1"[^>]*>)(.*?)(</h1>)', lambda m: f"{m[1]}{m[2]} [{key}]{m[3]}",
+                      self.article_page, count=1)
+        # разметка как на jw.org: form_telegraph_page снимает noscript и span и меняет _xs на _lg
+        image_names = [f"{'shared-' if i < self.shared_images else ''}{i}_xs.jpg" for i in range(self.images_per_article)]
+        images = ''.join(f'<figure><span class="jsRespImg" data-img-type="lsr"><noscript>'
+                         f'<img alt="" src="{ASSETS_HOST}/assets/m/{quote(key)}/{name}"/></noscript></span></figure>'
+                         for name in image_names)
+        page = page.replace('<div class="docSubContent">', f'<div class="docSubContent">{images}', 1)
+        page = page.replace(ASSETS_HOST, f"{self.base_url}/assets")
+        audio = f'<audio class="vjs-tech" src="{self.base_url}/audio/{quote(key)}.mp3"></audio>'
+        page = page.replace('</body>', f"{audio}</body>", 1)
+        return web.Response(text=page, content_type='text/html')
+
+    async def audio_file(self, request: web.Request) -> web.Response:
+        self._count('audio')
+        return web.Response(body=self.audio, content_type='audio/mpeg')
+
+    async def asset(self, request: web.Request) -> web.Response:
+        self._count('asset')
+        # у разных изображений разное содержимое, иначе все они совпали бы по хэшу; у shared-изображений оно
+        # зависит только от имени файла и одинаково во всех статьях
+        name = request.match_info['name']
+        if Path(name).name.startswith('shared-'):
+            name = Path(name).name
+        digest = sha1(name.encode('utf-8')).digest()
+        image = (digest * (self.image_size // len(digest) + 1))[:self.image_size]
+        return web.Response(body=image, content_type='image/jpeg')
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> web.AppRunner:
+        app = web.Application()
+        for language in self.issue_pages:
+            app.router.add_get(LOCALES[language].journals_path, partial(self.journals_list, language))
+        app.router.add_get('/{language}/fixture/issue/{symbol}/{year}/{number}/', self.issue)
+        app.router.add_get('/{language}/fixture/article/{symbol}/{year}/{number}/{slug}/', self.article)
+        app.router.add_get('/audio/{name:.+}', self.audio_file)
+        app.router.add_get('/assets/{name:.+}', self.asset)
+
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}"
+        return runner
+
+
+class FakeTelegraph:
+    """Заменяет telegraph.aio.Telegraph: отвечает как API, не выходя в сеть."""
+    pages = 0
+    uploads = 0
+    latency = 0.0
+
+    def __init__(self, access_token=None, domain='telegra.ph'):
+        self.access_token = access_token
+
+    async def create_page(self, title, html_content=None, **kwargs) -> dict:
+        await asyncio.sleep(self.latency)
+        FakeTelegraph.pages += 1
+        path = f"fake-{FakeTelegraph.pages}"
+        return {'path': path, 'url': f"https://telegra.ph/{path}", 'title': title}
+
+    async def edit_page(self, path, title, html_content=None, **kwargs) -> dict:
+        await asyncio.sleep(self.latency)
+        return {'path': path, 'url': f"https://telegra.ph/{path}", 'title': title}
+
+    async def upload_file(self, f) -> list:
+        await asyncio.sleep(self.latency)
+        FakeTelegraph.uploads += 1
+        return [{'src': f"/file/fake-{FakeTelegraph.uploads}.jpg"}]
+
+
+class Timings:
+    def __init__(self):
+        # парсеры работают с разными страницами и с разной скоростью, поэтому у каждого свой ряд
+        self.parse: Dict[str, List[float]] = {}
+        self.sanitize: List[float] = []
+
+    def timed_soup(self, markup='', features=None, *args, **kwargs) -> BeautifulSoup:
+        started = time.perf_counter()
+        soup = BeautifulSoup(markup, features, *args, **kwargs)
+        parser = re.sub(r'\W', '_', features or 'default')
+        self.parse.setdefault(parser, []).append(time.perf_counter() - started)
+        return soup
+
+    def wrap_sanitize(self, func):
+        def wrapped(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.sanitize.append(time.perf_counter() - started)
+        return wrapped
+
+
+def db_writes() -> float:
+    return sum(REGISTRY.get_sample_value('jw_db_query_seconds_count', {'kind': kind}) or 0
+               for kind in WRITE_QUERY_KINDS)
+
+
+async def run_crawl(args: argparse.Namespace, work_dir: Path) -> dict:
+    server = FixtureServer(years=args.years, issues_per_year=args.issues_per_year,
+                           audio_size=args.audio_size, image_size=args.image_size,
+                           images_per_article=args.images_per_article, shared_images=args.shared_images)
+    runner = await server.start()
+
+    db.init(str(work_dir / 'bench.sqlite3'))
+    init_db()
+    files_dir = work_dir / 'files'
+    files_dir.mkdir()
+
+    timings = Timings()
+    FakeTelegraph.latency = args.telegraph_latency / 1000
+    common_functions.MAIN_URL = server.base_url
+    common_functions.FILE_DIR = files_dir
+    common_functions.Telegraph = FakeTelegraph
+    common_functions.BeautifulSoup = timings.timed_soup
+    common_functions.prepare_items = timings.wrap_sanitize(common_functions.prepare_items)
+    jw_watcher.MAIN_URL = server.base_url
+    jw_watcher.BeautifulSoup = timings.timed_soup
+
+    watcher = jw_watcher.JWWatcher(watcher_loop=asyncio.get_event_loop(), watcher_logger=logger,
+                                   languages=args.languages)
+
+    writes_before = db_writes()
+    started = time.perf_counter()
+    try:
+        await watcher.main()  # языки краулятся параллельно, как в боте
+    finally:
+        wall_time = time.perf_counter() - started
+        await common_functions.close_session()
+        await runner.cleanup()
+
+    pages = sum(server.requests.get(kind, 0) for kind in ('list', 'issue', 'article'))
+    return {
+        'wall_time_s': wall_time,
+        'requests': server.requests,
+        'pages': pages,
+        'pages_per_sec': pages / wall_time,
+        'articles_exported': FakeTelegraph.pages,
+        'articles_by_language': {language: Article.select().join(JournalIssue).join(Journal)
+                                 .where(Journal.language == language).count() for language in args.languages},
+        'image_fetches': server.requests.get('asset', 0),
+        'images_uploaded': FakeTelegraph.uploads,
+        'audio_files': len(list(files_dir.iterdir())),
+        **{f"parse_{parser}_{stat}_ms": percentile(values, q) * 1000
+           for parser, values in sorted(timings.parse.items()) for stat, q in (('p50', 50), ('p99', 99))},
+        'sanitize_p50_ms': percentile(timings.sanitize, 50) * 1000,
+        'sanitize_p99_ms': percentile(timings.sanitize, 99) * 1000,
+        'db_writes': db_writes() - writes_before,
+        'db_writes_per_sec': (db_writes() - writes_before) / wall_time,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> bool:
+    ok = True
+    print(f"\nCompared to {baseline.get('revision') or 'baseline'} ({baseline.get('timestamp')}):")
+    for key, value in results['results'].items():
+        previous = baseline['results'].get(key)
+        if not isinstance(value, (int, float)) or not isinstance(previous, (int, float)) or not previous:
+            continue
+        change = (value - previous) / previous * 100
+        lower_is_better = key in LOWER_IS_BETTER or key.endswith(LOWER_IS_BETTER_SUFFIXES)
+        regression = change if lower_is_better else -change
+        marker = ''
+        if (lower_is_better or key in ('pages_per_sec', 'db_writes_per_sec')) and regression > max_regression:
+            marker = '  <-- REGRESSION'
+            ok = False
+        print(f"  {key:<28} {previous:>12.2f} -> {value:>12.2f} ({change:+.1f}%){marker}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline crawler benchmark on recorded jw.org pages')
+    parser.add_argument('--languages', nargs='+', choices=list(ISSUE_PAGES), default=list(ISSUE_PAGES))
+    parser.add_argument('--years', type=int, nargs='+', default=[2022])
+    parser.add_argument('--issues-per-year', type=int, default=3)
+    parser.add_argument('--audio-size', type=int, default=1024 * 1024, help='bytes per audio file')
+    parser.add_argument('--image-size', type=int, default=64 * 1024, help='bytes per image')
+    parser.add_argument('--images-per-article', type=int, default=4, help='images added to every article')
+    parser.add_argument('--shared-images', type=int, default=1,
+                        help='of them, images with the same content in every article under different URLs')
+    parser.add_argument('--telegraph-latency', type=float, default=0, help='fake Telegraph latency, ms')
+    parser.add_argument('--output', type=Path, help='save results as JSON')
+    parser.add_argument('--compare', type=Path, help='JSON results of a previous run')
+    parser.add_argument('--max-regression', type=float, default=10, help='allowed regression, percent')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
+
+    with tempfile.TemporaryDirectory(prefix='jw_bench_') as work_dir:
+        crawl_results = asyncio.get_event_loop().run_until_complete(run_crawl(args, Path(work_dir)))
+
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': crawl_results,
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, ensure_ascii=False))
+
+    if args.compare and not compare(results, json.loads(args.compare.read_text()), args.max_regression):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 import asyncio
+import importlib
 import json
 import logging
+from typing import Optional
 
 from aiogram import Bot
 from aiogram.types import Message, CallbackQuery
@@ -9,22 +11,31 @@ from aiogram.utils import executor
 from aiogram.types.inline_keyboard import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.types.reply_keyboard import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 
-from common_functions import init_routing
+from catalog import catalog, CatalogSnapshot
 from config import BOT_TOKEN, ACCESS_CONTROL_CHANNEL_ID
-from models import User, Routing, Article, Journal, JournalIssue, init_db
-from jw_watcher import JWWatcher
-from string_resources import STRESS
+from locales import LOCALES, DEFAULT_LANGUAGE
+from logging_config import setup_logging, log_failure
+from models import User, Routing, Article, JournalIssue, init_db, init_routing
+from metrics import observe_handler, observe_bot_api, trace_update, start_metrics_server, monitor_event_loop_lag
+from string_resources import STRESS, MENU_STRESS
 
-bot = Bot(token=BOT_TOKEN)
+
+class InstrumentedBot(Bot):
+    async def request(self, method, data=None, files=None, **kwargs):
+        with observe_bot_api(method):
+            return await super().request(method, data, files, **kwargs)
+
+
+bot = InstrumentedBot(token=BOT_TOKEN)
 dp = Dispatcher(bot)
 
 TELEGRAPH_URL = "https://telegra.ph/"
 
+logger = logging.getLogger('jw_bot')
 
-logging.basicConfig(level=logging.ERROR,
-                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                    datefmt='%m-%d %H:%M',
-                    filename='./logs/log')
+# действия inline-кнопок; callback_data присылает клиент, поэтому в метки метрик попадают только эти значения
+CALLBACK_ACTIONS = ('select_language', 'set_language', 'select_journal', 'select_journal_year', 'select_issue',
+                    'select_article', 'send_article', 'set_access')
 
 
 def check_access(func, *args, **kwargs):
@@ -44,6 +55,7 @@ async def ping(message: Message):
 async def init(message: Message):
     init_db()
     init_routing()
+    catalog.invalidate_all()
     await message.reply('Init successful')
 
 
@@ -81,6 +93,15 @@ async def send_access_request(user):
     user.save()
 
 
+@dp.message_handler(commands=['language'])
+async def language(message: Message):
+    user = User.cog(message)
+    if not user.access:
+        await message.reply('У вас нет доступа к контенту')
+        return
+    await select_language(user, {})
+
+
 @dp.message_handler(commands=['start'])
 async def start(message: Message):
     user = User.cog(message)
@@ -88,54 +109,97 @@ async def start(message: Message):
     await send_access_request(user)
 
 
+def menu_text(user: User, key: str) -> str:
+    return MENU_STRESS.get(user.language, MENU_STRESS[DEFAULT_LANGUAGE])[key]
+
+
+async def find_snapshot(user: User, index: str, key) -> Optional[CatalogSnapshot]:
+    """Снимок каталога, в индексе index которого есть key: сначала на языке пользователя, затем на остальных.
+    Кнопки меню, присланного до смены языка, ссылаются на журналы, выпуски и статьи прежнего языка.
+    """
+    for language in [user.language] + [code for code in LOCALES if code != user.language]:
+        snapshot = await catalog.get(language)
+        if key in getattr(snapshot, index):
+            return snapshot
+    return None
+
+
+async def select_language(user: User, data: dict):
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    for locale in LOCALES.values():
+        callback_data = {
+            'action': 'set_language',
+            'language': locale.code
+        }
+        keyboard.insert(InlineKeyboardButton(text=locale.name, callback_data=json.dumps(callback_data)))
+    await bot.send_message(user.user_id, STRESS['select_language'], reply_markup=keyboard)
+
+
+async def set_language(user: User, data: dict):
+    if data['language'] in LOCALES:
+        user.language = data['language']
+        user.save()
+    await select_journal(user, data)
+
+
 async def select_journal(user: User, message: Message):
     callback_data = {}
     keyboard = InlineKeyboardMarkup()
-    for journal in Journal.select():
-        if len(journal.issues) == 0:
-            continue
+    for journal in (await catalog.get(user.language)).journals:  # только журналы, у которых есть выпуски
         callback_data['action'] = 'select_journal_year'
         callback_data['journal_id'] = journal.id  # Сторожевая башня
         keyboard.add(InlineKeyboardButton(text=journal.title, callback_data=json.dumps(callback_data)))
-    await bot.send_message(user.user_id, 'Какой журнал Вас интересует?', reply_markup=keyboard)
+    keyboard.add(InlineKeyboardButton(text=menu_text(user, 'language_btn'),
+                                      callback_data=json.dumps({'action': 'select_language'})))
+    await bot.send_message(user.user_id, menu_text(user, 'select_journal'), reply_markup=keyboard)
 
 
 async def select_journal_year(user: User, data: dict):
     keyboard = InlineKeyboardMarkup(row_width=2)
-    journal = Journal.get(Journal.id == data['journal_id'])
-    for journal_issue in (JournalIssue.select(JournalIssue.year)
-                                      .where(JournalIssue.journal == journal).distinct()
-                                      .order_by(JournalIssue.year.desc())):
+    snapshot = await find_snapshot(user, 'years', data['journal_id'])
+    if not snapshot:
+        await select_journal(user, data)
+        return
+    for year in snapshot.years[data['journal_id']]:
         callback_data = {
             'action': 'select_issue',
             'journal_id': data['journal_id'],
-            'year': journal_issue.year
+            'year': year
         }
-        n = len(json.dumps(callback_data))
-        keyboard.add(InlineKeyboardButton(text=journal_issue.year, callback_data=json.dumps(callback_data)))
-    await bot.send_message(user.user_id, 'Выберите год:', reply_markup=keyboard)
+        keyboard.add(InlineKeyboardButton(text=year, callback_data=json.dumps(callback_data)))
+    await bot.send_message(user.user_id, menu_text(user, 'select_year'), reply_markup=keyboard)
 
 
 async def select_issue(user: User, data: dict):
     keyboard = InlineKeyboardMarkup(row_width=2)
-    journal = Journal.get(Journal.id == data['journal_id'])
     year = data.get('year', 2021)
-    for journal_issue in JournalIssue.select().where(JournalIssue.journal == journal, JournalIssue.year == year).order_by(JournalIssue.number):
-        if len(journal_issue.articles) == 0:
-            continue
+    snapshot = await find_snapshot(user, 'issues', (data['journal_id'], year))
+    if not snapshot:
+        await select_journal(user, data)
+        return
+    for journal_issue in snapshot.issues[(data['journal_id'], year)]:  # только выпуски со статьями
         callback_data = {  # max length 64 symbols
             'action': 'select_article',
             'journal_issue_id': journal_issue.id
         }
         keyboard.add(InlineKeyboardButton(text=f"№{journal_issue.number}|{journal_issue.title}",
                                           callback_data=json.dumps(callback_data)))
-    await bot.send_message(user.user_id, 'Выберите номер журнала:', reply_markup=keyboard)
+    await bot.send_message(user.user_id, menu_text(user, 'select_issue'), reply_markup=keyboard)
 
 
 async def select_article(user: User, data: dict):
     keyboard = InlineKeyboardMarkup(row_width=2)
-    journal_issue = JournalIssue.get(JournalIssue.id == data['journal_issue_id'])
-    for article in Article.select().where(Article.journal_issue == journal_issue):
+    snapshot = await find_snapshot(user, 'issue_by_id', data['journal_issue_id'])
+    if snapshot:
+        journal_issue = snapshot.issue_by_id[data['journal_issue_id']]
+        articles = snapshot.articles.get(journal_issue.id, [])
+    else:  # выпуск мог появиться в базе раньше, чем каталог перестроился
+        journal_issue = JournalIssue.get_or_none(JournalIssue.id == data['journal_issue_id'])
+        if not journal_issue:
+            await select_journal(user, data)
+            return
+        articles = Article.select().where(Article.journal_issue == journal_issue).order_by(Article.id)
+    for article in articles:
         callback_data = {
             'action': 'send_article',
             'article_id': article.id
@@ -143,12 +207,19 @@ async def select_article(user: User, data: dict):
         keyboard.add(InlineKeyboardButton(text=article.title, callback_data=json.dumps(callback_data)))
     await bot.send_message(user.user_id,
                            f'***{journal_issue.title}*** \n\n {journal_issue.annotation}\n\n'
-                           f'Выберите статью:',
+                           f"{menu_text(user, 'select_article')}",
                            reply_markup=keyboard, parse_mode='Markdown')
 
 
 async def send_article(user: User, data: dict):
-    article = Article.get(Article.id == data['article_id'])
+    snapshot = await find_snapshot(user, 'article_by_id', data['article_id'])
+    if snapshot:
+        article = snapshot.article_by_id[data['article_id']]
+    else:
+        article = Article.get_or_none(Article.id == data['article_id'])
+        if not article:
+            await select_journal(user, data)
+            return
     await bot.send_message(user.user_id, f"{TELEGRAPH_URL}{article.telegraph_path}")
 
 
@@ -184,36 +255,65 @@ async def set_access(user: User, data: dict):
 
 @dp.callback_query_handler()
 async def callback_handler(callback: CallbackQuery):
-    print(callback.data)
+    logger.debug(callback.data)
     callback_data = json.loads(callback.data)
-    user = User.cog(callback)
-    await callback.answer(show_alert=True)
-    await eval(callback_data['action'])(user, callback_data)
+    action = callback_data['action']
+    label = action if action in CALLBACK_ACTIONS else 'unknown'
+    with trace_update(f"callback {callback.id} {label}"), observe_handler(label):
+        user = User.cog(callback)
+        await callback.answer(show_alert=True)
+        await eval(action)(user, callback_data)
 
 
 @dp.message_handler(content_types=['text'])
 async def text_handler(message: Message):
-    print(message)
-    user = User.cog(message)
-    if not user.access:
-        await message.reply('У вас нет доступа к контенту')
-        return
-
-    try:
-        r = Routing.get(state=user.state, decision='text')
-        try:  # на случай если action не определён в таблице роутинга
-            await eval(r.action)(user=user, message=message)
+    logger.debug(message)
+    with trace_update(f"message {message.message_id}"):
+        user = User.cog(message)
+        if not user.access:
+            await message.reply('У вас нет доступа к контенту')
+            return
+
+        try:
+            r = Routing.get(state=user.state, decision='text')
+            try:  # на случай если action не определён в таблице роутинга
+                with observe_handler(r.action):
+                    await eval(r.action)(user=user, message=message)
+            except Exception as e:
+                print(e)
         except Exception as e:
             print(e)
-    except Exception as e:
-        print(e)
+
+
+def run_in_background(dispatcher: Dispatcher, future: asyncio.Future, what: str) -> asyncio.Future:
+    """Держит ссылку на фоновую задачу, пока она не завершится, и пишет в лог её исключение."""
+    background_tasks = dispatcher.data.setdefault('background_tasks', set())
+    background_tasks.add(future)
+    future.add_done_callback(background_tasks.discard)
+    future.add_done_callback(log_failure(logger, what))
+    return future
+
+
+async def start_watcher(dispatcher: Dispatcher, loop: asyncio.AbstractEventLoop):
+    # краулер тянет BeautifulSoup, lxml, html5lib и telegraph -- импортируем его в фоне, когда бот уже опрашивает
+    jw_watcher = await loop.run_in_executor(None, importlib.import_module, 'jw_watcher')
+    dispatcher['jw_watcher'] = jw_watcher.JWWatcher(watcher_loop=loop, watcher_logger=logger,
+                                                    languages=jw_watcher.CRAWL_LANGUAGES)
+    dispatcher['jw_watcher'].start()
+
+
+async def on_startup(dispatcher: Dispatcher):
+    init_db()
+
+    loop = asyncio.get_event_loop()
+    run_in_background(dispatcher, loop.create_task(monitor_event_loop_lag()), 'Event loop lag monitor')
+    run_in_background(dispatcher, loop.create_task(catalog.warm()), 'Catalog warm-up')
+    run_in_background(dispatcher, loop.create_task(start_watcher(dispatcher, loop)), 'Crawler start')
 
 
 if __name__ == '__main__':
-    logger = logging.getLogger('jw_bot')
+    setup_logging()
     logger.setLevel(logging.INFO)
 
-    event_loop = asyncio.get_event_loop()
-    jw_watcher = JWWatcher(watcher_loop=event_loop, watcher_logger=logger)
-    jw_watcher.start()
-    executor.start_polling(dp)
+    start_metrics_server()
+    executor.start_polling(dp, on_startup=on_startup)
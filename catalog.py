@@ -0,0 +1,147 @@
+"""Кэш каталога, из которого строятся меню бота.
+
+Каталог каждого языка (журналы, выпуски, статьи) читается из базы несколькими запросами и держится в памяти, так
+что навигация по меню не ходит в базу. Раз в CATALOG_CHECK_INTERVAL секунд кэш сверяет с базой число и последний id
+выпусков и статей: так он замечает и краулер, запущенный отдельным процессом (python jw_watcher.py). Снимки строятся
+в пуле потоков; пока новый снимок строится, обработчики отдают прежний, а если снимка языка ещё нет -- ждут
+его постройки, не блокируя event loop.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from peewee import fn
+
+import config
+from locales import LOCALES
+from models import Article, Journal, JournalIssue
+
+CATALOG_CHECK_INTERVAL = getattr(config, 'CATALOG_CHECK_INTERVAL', 10)  # секунды между проверками базы
+
+logger = logging.getLogger('jw_bot.catalog')
+
+
+class CatalogSnapshot:
+    def __init__(self):
+        self.journals: List[Journal] = []  # только журналы, у которых есть выпуски
+        self.years: Dict[int, List[int]] = {}  # journal_id -> годы выпусков по убыванию
+        self.issues: Dict[Tuple[int, int], List[JournalIssue]] = {}  # (journal_id, year) -> выпуски со статьями
+        self.issue_by_id: Dict[int, JournalIssue] = {}
+        self.articles: Dict[int, List[Article]] = {}  # journal_issue_id -> статьи выпуска
+        self.article_by_id: Dict[int, Article] = {}
+
+
+def build_snapshot(language: str) -> CatalogSnapshot:
+    snapshot = CatalogSnapshot()
+
+    for article in (Article.select(Article.id, Article.title, Article.telegraph_path, Article.journal_issue)
+                           .join(JournalIssue).join(Journal)
+                           .where(Journal.language == language)
+                           .order_by(Article.id)):
+        snapshot.articles.setdefault(article.journal_issue_id, []).append(article)
+        snapshot.article_by_id[article.id] = article
+
+    for journal_issue in (JournalIssue.select(JournalIssue)
+                                      .join(Journal)
+                                      .where(Journal.language == language)
+                                      .order_by(JournalIssue.year.desc(), JournalIssue.number)):
+        snapshot.issue_by_id[journal_issue.id] = journal_issue
+        years = snapshot.years.setdefault(journal_issue.journal_id, [])
+        if not years or years[-1] != journal_issue.year:
+            years.append(journal_issue.year)
+        if journal_issue.id in snapshot.articles:
+            snapshot.issues.setdefault((journal_issue.journal_id, journal_issue.year), []).append(journal_issue)
+
+    snapshot.journals = [journal for journal in
+                         Journal.select().where(Journal.language == language).order_by(Journal.id)
+                         if journal.id in snapshot.years]
+    return snapshot
+
+
+class CatalogCache:
+    def __init__(self):
+        self._snapshots: Dict[str, CatalogSnapshot] = {}
+        self._snapshot_versions: Dict[str, tuple] = {}  # версия базы, из которой построен снимок
+        self._generations: Dict[str, int] = {}
+        self._builds: Dict[str, asyncio.Future] = {}
+        self._db_version: Optional[tuple] = None
+        self._checked_at = 0.0
+
+    @staticmethod
+    def read_db_version() -> tuple:
+        """Меняется, когда в базе появляются или пропадают выпуски и статьи."""
+        return (JournalIssue.select(fn.COUNT(JournalIssue.id), fn.MAX(JournalIssue.id)).tuples().get() +
+                Article.select(fn.COUNT(Article.id), fn.MAX(Article.id)).tuples().get())
+
+    def _current_db_version(self) -> tuple:
+        if self._db_version is None or time.monotonic() - self._checked_at >= CATALOG_CHECK_INTERVAL:
+            self._db_version = self.read_db_version()
+            self._checked_at = time.monotonic()
+        return self._db_version
+
+    def invalidate(self, language: str):
+        self._generations[language] = self._generations.get(language, 0) + 1
+        self._snapshots.pop(language, None)
+
+    def invalidate_all(self):
+        for language in set(LOCALES) | set(self._snapshots):
+            self.invalidate(language)
+        self._db_version = None
+
+    def _build(self, language: str) -> Tuple[tuple, CatalogSnapshot]:
+        # версия читается до снимка: изменения, сделанные во время постройки, заметит следующая проверка
+        version = self.read_db_version()
+        return version, build_snapshot(language)
+
+    def refresh(self, language: str) -> asyncio.Future:
+        """Перестраивает снимок языка в пуле потоков. Одновременные вызовы получают одну и ту же постройку."""
+        build = self._builds.get(language)
+        if build is not None:
+            return build
+
+        generation = self._generations.get(language, 0)
+
+        def store(future: asyncio.Future):
+            del self._builds[language]
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                logger.exception(f"Catalog build failed for language {language}", exc_info=future.exception())
+                return
+            version, snapshot = future.result()
+            self._db_version, self._checked_at = version, time.monotonic()
+            if generation == self._generations.get(language, 0):  # кэш не сбросили, пока он строился
+                self._snapshot_versions[language], self._snapshots[language] = version, snapshot
+
+        build = asyncio.get_event_loop().run_in_executor(None, self._build, language)
+        build.add_done_callback(store)
+        self._builds[language] = build
+        return build
+
+    def changed(self, language: str) -> Optional[asyncio.Future]:
+        """Краулер этого процесса изменил каталог языка: загруженный снимок перестраивается сразу, не дожидаясь
+        проверки базы. Незагруженный язык построит первый get().
+        """
+        self._db_version = None
+        if language in self._snapshots:
+            return self.refresh(language)
+        return None
+
+    async def warm(self):
+        await asyncio.gather(*(self.get(language) for language in LOCALES))
+        logger.info("Catalog cache is warm")
+
+    async def get(self, language: str) -> CatalogSnapshot:
+        snapshot = self._snapshots.get(language)
+        if snapshot is not None and self._snapshot_versions[language] == self._current_db_version():
+            return snapshot
+
+        build = self.refresh(language)
+        if snapshot is not None:  # устаревший снимок отдаём, пока строится новый
+            return snapshot
+        _, snapshot = await asyncio.shield(build)
+        return snapshot
+
+
+catalog = CatalogCache()
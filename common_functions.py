@@ -1,74 +1,106 @@
+import asyncio
 import logging
-import re
+import time
+from collections import OrderedDict
 from hashlib import sha1
+from io import BytesIO
 
-import sqlite3
 from pathlib import Path
 from sqlite3 import IntegrityError
-from typing import Tuple, List, Collection
+from typing import Tuple, List, Collection, Dict, Optional
+from urllib.parse import unquote, urlparse
 
 from bs4 import BeautifulSoup, Tag, NavigableString
 
-from aiohttp import ClientSession
+from aiohttp import ClientSession, TCPConnector
 from telegraph.aio import Telegraph
 from telegraph.exceptions import NotAllowedTag, TelegraphException
 
 from config import TELEGRAPH_USER_TOKEN
-from models import Article, JournalIssue, Journal
+from locales import LOCALES, DEFAULT_LANGUAGE
+from metrics import observe_http_fetch, observe_telegraph, crawler_stage
+from models import Article, JournalIssue, Journal, Image, init_routing
 
 MAIN_URL = "https://www.jw.org"
 CHUNK_SIZE = 1024
 FILE_DIR = Path("./files")
+HTTP_POOL_SIZE = 16  # общий пул соединений для всех языковых конвейеров краулера
+PAGE_CACHE_SIZE = 64
+PAGE_CACHE_TTL = 600  # секунды
+IMAGE_CONCURRENCY = 8  # одновременных загрузок изображений одной статьи
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')  # форматы, которые принимает Telegraph
 
 AVAILABLE_TAGS = ['a', 'aside', 'b', 'blockquote', 'br', 'code', 'em', 'figcaption', 'figure',
                   'h3', 'h4', 'hr', 'i', 'iframe', 'img', 'li', 'ol', 'p', 'pre', 's',
                   'strong', 'u', 'ul', 'video']
 # AVAILABLE_TAGS = ['h1', 'h3', 'h4', 'hr', 'img', 'p', 'ul', 'ol', 'a', 'strong']
 
-LOG_PATH = Path('./logs/log')
-LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
-
-logging.basicConfig(level=logging.ERROR,
-                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                    datefmt='%m-%d %H:%M',
-                    filename='./logs/log')
 logger = logging.getLogger('jwwatcher')
 logger.setLevel(logging.INFO)
 
-
-def init_routing():
-    with open("routing.sql", "r") as f:
-        route = f.read()
-        route = re.sub(r'\n', '', route)
-        route = re.sub(r'\s+', ' ', route)
-        conn = sqlite3.connect('db.sqlite3')
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM routing;")  # сначала очистим таблицу роутинга
-        conn.commit()
-
-        cursor.execute(route)
-        conn.commit()
-        conn.close()
+_session: Optional[ClientSession] = None
+_page_cache: 'OrderedDict[tuple, Tuple[float, str]]' = OrderedDict()
+_pending_pages: Dict[tuple, asyncio.Future] = {}
+_image_locks: Dict[str, asyncio.Lock] = {}
 
 
 def set_init_db_values():
     init_routing()
 
 
-async def get_page_source(url, params=None) -> str:
-    async with ClientSession() as session:
-        async with session.get(url, params=params) as response:
+def get_session() -> ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = ClientSession(connector=TCPConnector(limit=HTTP_POOL_SIZE))
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+    _page_cache.clear()
+    _image_locks.clear()
+
+
+async def _fetch_page(url, params=None) -> str:
+    with observe_http_fetch(url):
+        async with get_session().get(url, params=params) as response:
             return await response.text()
 
 
+async def get_page_source(url, params=None) -> str:
+    """Страницы кэшируются: статья запрашивается и при экспорте, и при поиске аудио, а одновременные запросы
+    одной и той же страницы из разных конвейеров превращаются в один.
+    """
+    key = (url, tuple(sorted((params or {}).items())))
+    cached = _page_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < PAGE_CACHE_TTL:
+        _page_cache.move_to_end(key)
+        return cached[1]
+
+    pending = _pending_pages.get(key)
+    if pending is None:
+        pending = _pending_pages[key] = asyncio.ensure_future(_fetch_page(url, params))
+        pending.add_done_callback(lambda _: _pending_pages.pop(key, None))
+    page = await asyncio.shield(pending)
+
+    _page_cache[key] = (time.monotonic(), page)
+    _page_cache.move_to_end(key)
+    while len(_page_cache) > PAGE_CACHE_SIZE:
+        _page_cache.popitem(last=False)
+    return page
+
+
 async def download_file(file_url: str, file_name=None, params=None):
     if file_name:
-        file_path = FILE_DIR / f"{file_name.rsplit('/')[1]}.mp3"
+        file_path = FILE_DIR / f"{unquote(file_name.rsplit('/')[-1])}.mp3"
     else:
         file_path = FILE_DIR / file_url.rsplit("/")[0]
 
-    async with ClientSession() as session:
-        async with session.get(file_url, params=params) as response:
+    with observe_http_fetch(file_url):
+        async with get_session().get(file_url, params=params) as response:
             with open(file_path, 'wb') as fd:
                 async for chunk in response.content.iter_chunked(CHUNK_SIZE):
                     fd.write(chunk)
@@ -146,18 +178,79 @@ def form_telegraph_page(page_source: str) -> Tuple[str, str]:
     return header.text, prepared_telegraph_page
 
 
+def is_proxied_image(src: Optional[str]) -> bool:
+    url = urlparse(src or '')
+    return url.scheme in ('http', 'https') and url.path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+async def get_image_telegraph_path(telegraph: Telegraph, url: str) -> str:
+    """Возвращает путь изображения в хранилище Telegraph. Каждый адрес скачивается один раз, каждое
+    содержимое загружается один раз -- соответствие хранится в таблице Image.
+    """
+    async with _image_locks.setdefault(url, asyncio.Lock()):
+        image = Image.get_or_none(Image.source_url == url)
+        if image:
+            return image.telegraph_path
+
+        with observe_http_fetch(url):
+            async with get_session().get(url) as response:
+                response.raise_for_status()
+                content = await response.read()
+        content_hash = sha1(content).hexdigest()
+
+        async with _image_locks.setdefault(content_hash, asyncio.Lock()):
+            same_image = Image.get_or_none(Image.content_hash == content_hash)
+            if same_image:
+                telegraph_path = same_image.telegraph_path
+            else:
+                with observe_telegraph('upload_file'):
+                    uploaded = await telegraph.upload_file((BytesIO(content), Path(urlparse(url).path).name))
+                telegraph_path = uploaded[0]['src']
+
+            Image.create(source_url=url, content_hash=content_hash, telegraph_path=telegraph_path)
+        return telegraph_path
+
+
+async def upload_article_images(telegraph: Telegraph, html_content: str) -> str:
+    """Переносит изображения статьи в хранилище Telegraph и подменяет src, чтобы страницы не грузили
+    полноразмерные изображения с jw.org. Если изображение загрузить не удалось, остаётся исходная ссылка.
+    """
+    soup = BeautifulSoup(html_content, 'html.parser')
+    images = [img for img in soup.find_all('img') if is_proxied_image(img.get('src'))]
+    semaphore = asyncio.Semaphore(IMAGE_CONCURRENCY)
+
+    async def upload(url: str) -> Tuple[str, Optional[str]]:
+        async with semaphore:
+            try:
+                return url, await get_image_telegraph_path(telegraph, url)
+            except Exception as e:
+                logger.exception(f"Image was not uploaded to Telegraph: {url}, {e}")
+                return url, None
+
+    telegraph_paths = dict(await asyncio.gather(*(upload(url) for url in {img['src'] for img in images})))
+    for img in images:
+        if telegraph_paths.get(img['src']):
+            img['src'] = telegraph_paths[img['src']]
+
+    return str(soup)
+
+
 async def export_article_to_telegraph(journal_issue: JournalIssue, link: str) -> Article:
     page_source = await get_page_source(f"{MAIN_URL}{link}")
 
     header, html_content = form_telegraph_page(page_source)
+
+    telegraph = Telegraph(TELEGRAPH_USER_TOKEN)
+    with crawler_stage('images'):
+        html_content = await upload_article_images(telegraph, html_content)
     current_article_hash = calc_article_hash(html_content)
 
     article = Article.get_or_none(Article.url == link)
 
-    telegraph = Telegraph(TELEGRAPH_USER_TOKEN)
     if not article:
         try:
-            telegraph_response = await telegraph.create_page(title=header, html_content=html_content)
+            with observe_telegraph('create_page'):
+                telegraph_response = await telegraph.create_page(title=header, html_content=html_content)
 
             new_article = Article.create(title=telegraph_response['title'],
                                          url=link,
@@ -181,8 +274,9 @@ async def export_article_to_telegraph(journal_issue: JournalIssue, link: str) ->
 
     elif article.content_hash != current_article_hash:
         try:
-            telegraph_raw_response = await telegraph.edit_page(path=article.telegraph_path, title=header,
-                                                               html_content=html_content)
+            with observe_telegraph('edit_page'):
+                telegraph_raw_response = await telegraph.edit_page(path=article.telegraph_path, title=header,
+                                                                   html_content=html_content)
             article.content_hash = current_article_hash
             article.save()
             logger.info(f"Edited article. Article id: {article.id}, Telegraph URL: {article.telegraph_path}")
@@ -193,19 +287,5 @@ async def export_article_to_telegraph(journal_issue: JournalIssue, link: str) ->
     return article
 
 
-def month_to_number(month_name: str) -> int:
-    month_name = month_name.lower()
-    return {
-            'январь': 1,
-            'февраль': 2,
-            'март': 3,
-            'апрель': 4,
-            'май': 5,
-            'июнь': 6,
-            'июль': 7,
-            'август': 8,
-            'сентябрь': 9,
-            'октябрь': 10,
-            'ноябрь': 11,
-            'декабрь': 12
-    }[month_name]
+def month_to_number(month_name: str, language: str = DEFAULT_LANGUAGE) -> int:
+    return LOCALES[language].month_to_number(month_name)
@@ -1,47 +1,62 @@
 import asyncio
-import locale
 import logging
-import re
 from logging import Logger
 from asyncio import AbstractEventLoop
+from concurrent.futures import Future
 from datetime import datetime
 from pathlib import Path
 from threading import Thread
-from typing import Tuple
+from typing import Iterable, Optional
 
-from bs4 import BeautifulSoup, Tag
+from bs4 import BeautifulSoup
 from peewee import ModelSelect
 from telegraph import TelegraphException
 
-from common_functions import get_page_source, export_article_to_telegraph, LOG_PATH, month_to_number, download_file
-from models import Journal, JournalIssue, init_db
+import config
+from catalog import catalog
+from common_functions import get_page_source, export_article_to_telegraph, download_file, close_session
+from locales import LOCALES, Locale
+from logging_config import setup_logging, log_failure
+from metrics import crawler_stage, start_metrics_server, monitor_event_loop_lag, WATCHER_METRICS_PORT
+from models import Article, Journal, JournalIssue, init_db
 
-logging.basicConfig(level=logging.ERROR,
-                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                    datefmt='%m-%d %H:%M',
-                    filename=LOG_PATH)
-
-locale.setlocale(locale.LC_TIME, 'ru_RU.UTF-8')
+logger = logging.getLogger('jw_watcher')
 
 MAIN_URL = "https://www.jw.org"
+# языки, которые обходит краулер; можно задать в config.py, например CRAWL_LANGUAGES = ('ru',)
+CRAWL_LANGUAGES = getattr(config, 'CRAWL_LANGUAGES', tuple(LOCALES))
 
 
 class JWWatcher(Thread):
-    def __init__(self, watcher_loop: AbstractEventLoop, watcher_logger: Logger):
-        init_db()  # create db tables
+    def __init__(self, watcher_loop: AbstractEventLoop, watcher_logger: Logger, languages: Iterable[str] = None):
         super().__init__()
         self.loop = watcher_loop
         self.logger = watcher_logger
+        self.languages = list(languages or LOCALES)
+        unknown = set(self.languages) - set(LOCALES)
+        if unknown:
+            raise ValueError(f"Unknown crawl languages: {', '.join(sorted(unknown))}")
+        self.future: Optional[Future] = None
 
     async def main(self):
+        # языковые конвейеры идут параллельно и делят пул соединений и кэш страниц из common_functions
+        try:
+            results = await asyncio.gather(*(self.crawl_locale(LOCALES[language]) for language in self.languages),
+                                           return_exceptions=True)
+            for language, result in zip(self.languages, results):
+                if isinstance(result, Exception):
+                    self.logger.exception(f"Crawling failed for language {language}", exc_info=result)
+        finally:
+            await close_session()
+
+    async def crawl_locale(self, locale: Locale):
         current_year = datetime.now().year
 
-        journals_list = await self.get_journals_list()
-        logger.debug(f"")
+        journals_list = await self.get_journals_list(locale)
 
         for year in range(current_year, 2000, -1):
             for journal in journals_list:
-                self.logger.info(f'Year: {year}; journal: {journal.title}')
+                self.logger.info(f'[{locale.code}] Year: {year}; journal: {journal.title}')
                 try:
                     await self.parse_journal_issues(journal=journal, year=year)
                 except Exception as e:
@@ -51,13 +66,15 @@ class JWWatcher(Thread):
         pass
 
     async def parse_journal_issues(self, journal: Journal, year: int):
+        locale = LOCALES[journal.language]
         params = {
-            'contentLanguageFilter': 'ru',
+            'contentLanguageFilter': locale.code,
             'pubFilter': journal.symbol,
             'yearFilter': year
         }
-        page_source = await get_page_source(f"{MAIN_URL}/ru/публикации/журналы/", params=params)
-        soup = BeautifulSoup(page_source, 'lxml')
+        with crawler_stage('journal_issues'):
+            page_source = await get_page_source(f"{MAIN_URL}{locale.journals_path}", params=params)
+            soup = BeautifulSoup(page_source, 'lxml')
 
         for item in soup.find_all(class_='publicationDesc'):
             try:
@@ -66,18 +83,20 @@ class JWWatcher(Thread):
                 self.logger.exception(e)
 
     @staticmethod
-    async def get_journals_list() -> ModelSelect:
-        """Получаем список журналов с их обозначениями, проверяем не появилось ли чего-то нового (скорее
+    async def get_journals_list(locale: Locale) -> ModelSelect:
+        """Получаем список журналов языка с их обозначениями, проверяем не появилось ли чего-то нового (скорее
         всего нет, но функция в первую очередь необходима при первичном запуске приложения)
         """
-        page_source = await get_page_source(f"{MAIN_URL}/ru/публикации/журналы/")
-        soup = BeautifulSoup(page_source, 'lxml')
+        with crawler_stage('journals_list'):
+            page_source = await get_page_source(f"{MAIN_URL}{locale.journals_path}")
+            soup = BeautifulSoup(page_source, 'lxml')
 
         journal_filter = soup.find('select', {'id': 'pubFilter'})
         for item in journal_filter.find_all('option'):
             if item['value']:
-                if not Journal.get_or_none(Journal.symbol == item['value']):
-                    journal = Journal.create(symbol=item['value'],
+                if not Journal.get_or_none(Journal.language == locale.code, Journal.symbol == item['value']):
+                    journal = Journal.create(language=locale.code,
+                                             symbol=item['value'],
                                              title=item.text,
                                              priority=int(item['data-priority']))
                     journal.save()
@@ -85,18 +104,19 @@ class JWWatcher(Thread):
                 else:
                     logger.debug(f"Parsed journal: {item.text}")
 
-        return Journal.select()
+        return Journal.select().where(Journal.language == locale.code)
 
     async def check_journal_issue_availability(self, journal: Journal, link: str):
         issue_link = f"{MAIN_URL}{link}"
         self.logger.info(f"Checking journal issue: {issue_link}")
-        page_source = await get_page_source(issue_link)
-        soup = BeautifulSoup(page_source, 'lxml')
+        with crawler_stage('issue'):
+            page_source = await get_page_source(issue_link)
+            soup = BeautifulSoup(page_source, 'lxml')
 
         main_frame = soup.find(id='article')
 
         context_title = main_frame.find('h1')
-        number, year, title = self.parse_journal_issue_title(context_title)
+        number, year, title = LOCALES[journal.language].parse_journal_issue_title(context_title)
         self.logger.info(f"Parse journal issue #{number}, {year}, {title}")
 
         section1 = main_frame.find('div',
@@ -117,43 +137,35 @@ class JWWatcher(Thread):
 
         journal_issue = JournalIssue.get_or_none(JournalIssue.journal == journal, JournalIssue.year == year,
                                                  JournalIssue.number == number)
+        changed = journal_issue is None
         if not journal_issue:
             journal_issue = JournalIssue.create(journal=journal, year=year, number=number,
                                                 title=title, annotation=annotation, link=link)
 
         article_items = main_frame.find_all('div', {'class': 'PublicationArticle'})
+        # каталог бота перестраивается, только если выпуск или его статьи создали или изменили
+        article_links = [item.find('a')['href'] for item in article_items]
+        known_hashes = {article.url: article.content_hash
+                        for article in Article.select(Article.url, Article.content_hash)
+                        .where(Article.url.in_(article_links))}
 
         for item in article_items:
             article_link = item.find('a')
             try:
-                article = await export_article_to_telegraph(journal_issue, article_link['href'])
+                with crawler_stage('article'):
+                    article = await export_article_to_telegraph(journal_issue, article_link['href'])
+                if article and article.content_hash != known_hashes.get(article_link['href']):
+                    changed = True
 
-                await self.download_article_voice_version(article_link['href'])
+                with crawler_stage('audio'):
+                    await self.download_article_voice_version(article_link['href'])
                 logger.debug(f"Article with ID = {article.id} processed")
 
             except Exception as e:
                 self.logger.exception(f"Article wasn't parsed: {MAIN_URL}{article_link['href']}")
 
-    @staticmethod
-    def parse_journal_issue_title(title: Tag) -> Tuple[str, str, str]:
-        # [s.extract() for s in title('span')]
-        match = re.search(r"(?P<number>(?<=№\s)\d+)\s(?P<year>\d{4})\s+\|\s(?P<title>.*)", title.text)
-
-        if match is None:
-            # &nbsp; symbol between month and year recognize as \S
-            match = re.search(r"(?P<month>\S*).(?P<year>\d{4})", title.text.strip())
-            month_name = match.group('month')
-            # dt = datetime.strptime(month_name, '%B')  # требует название месяца в родительном падеже,
-            # month_number = dt.month  # в именительном выдаёт ошибку
-            month_number = month_to_number(month_name)
-            title = title.find('span').text
-        else:
-            month_number = match.group('number')
-            title = match.group('title')
-
-        year = match.group('year')
-
-        return month_number, year, title
+        if changed:
+            catalog.changed(journal.language)
 
     @staticmethod
     async def download_article_voice_version(article_path: str) -> bool:
@@ -167,17 +179,23 @@ class JWWatcher(Thread):
         await download_file(audio_container['src'], file_name=file_name[-1])
 
     def run(self):
-        self.loop.create_task(self.main())
+        self.future = asyncio.run_coroutine_threadsafe(self.main(), self.loop)
+        self.future.add_done_callback(log_failure(self.logger, 'Crawler'))
 
 
 if __name__ == "__main__":
-    logger = logging.getLogger('jw_watcher')
+    setup_logging()
+    init_db()
+
     logger.setLevel(logging.INFO)
 
     logger_stream_handler = logging.StreamHandler()
     logger.addHandler(logger_stream_handler)
 
+    start_metrics_server(WATCHER_METRICS_PORT)
+
     loop = asyncio.get_event_loop()
-    watcher = JWWatcher(watcher_loop=loop, watcher_logger=logger)
+    loop.create_task(monitor_event_loop_lag())
+    watcher = JWWatcher(watcher_loop=loop, watcher_logger=logger, languages=CRAWL_LANGUAGES)
     loop.run_until_complete(watcher.main())
     loop.close()
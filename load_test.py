@@ -0,0 +1,271 @@
+"""Нагрузочный тест бота.
+
+Виртуальные пользователи с доступом проходят по каталогу так же, как живые: главное меню -> журнал -> год ->
+выпуск -> статья, каждый раз нажимая случайную кнопку из последней присланной им клавиатуры. Апдейты
+(Message и CallbackQuery) подаются прямо в Dispatcher, а бот ходит в локальный фейковый Bot API. Для каждого
+уровня параллельности выводятся перцентили времени обработки апдейта, число запросов к БД и к Bot API на
+апдейт и пропускная способность:
+
+    python load_test.py --concurrency 10 100 1000 --flows 5 --output load_results.json
+
+По умолчанию каталог генерируется во временной базе; --db позволяет взять копию настоящей.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.types import Update
+from aiohttp import web
+
+import bot as jw_bot
+from bench_utils import percentile, git_revision
+from metrics import collect_spans
+from models import db, init_db, User, Journal, JournalIssue, Article
+
+MAIN_MENU_TEXT = 'Главное меню'
+FLOW_DEPTH = 4  # журнал -> год -> выпуск -> статья
+SKIPPED_ACTIONS = ('select_language', 'set_language')  # смена языка не входит в проход по каталогу
+
+logger = logging.getLogger('jw_load_test')
+
+
+class FakeBotAPI:
+    """Локальный Bot API: отвечает на запросы бота и запоминает последнюю inline-клавиатуру каждого чата,
+    чтобы виртуальный пользователь мог по ней «нажать».
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.keyboards: Dict[int, list] = {}
+        self.message_id = 0
+        self.base_url = ''
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+        data = dict(await request.post())
+        await asyncio.sleep(self.latency)
+
+        result = True
+        if method in ('sendMessage', 'editMessageReplyMarkup'):
+            chat_id = int(data['chat_id'])
+            reply_markup = json.loads(data.get('reply_markup') or '{}')
+            if reply_markup and 'inline_keyboard' in reply_markup:
+                self.keyboards[chat_id] = [button for row in reply_markup['inline_keyboard'] for button in row]
+            self.message_id += 1
+            result = {'message_id': self.message_id, 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'private'}, 'text': data.get('text', '')}
+        return web.json_response({'ok': True, 'result': result})
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        self.base_url = f"http://{host}:{runner.addresses[0][1]}"
+        return runner
+
+
+class LoadStats:
+    def __init__(self):
+        self.latency: List[float] = []
+        self.db_queries: List[int] = []
+        self.api_calls: List[int] = []
+        self.errors = 0
+        self.updates = 0
+
+
+class VirtualUsers:
+    def __init__(self, dp: Dispatcher, api: FakeBotAPI, think_time: float):
+        self.dp = dp
+        self.api = api
+        self.think_time = think_time
+        self.update_id = 0
+
+    def _next_id(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}"}
+
+    def message_update(self, user_id: int, text: str) -> dict:
+        update_id = self._next_id()
+        return {'update_id': update_id,
+                'message': {'message_id': update_id, 'date': int(time.time()), 'text': text,
+                            'chat': {'id': user_id, 'type': 'private'}, 'from': self._user(user_id)}}
+
+    def callback_update(self, user_id: int, data: str) -> dict:
+        update_id = self._next_id()
+        return {'update_id': update_id,
+                'callback_query': {'id': str(update_id), 'from': self._user(user_id), 'chat_instance': str(user_id),
+                                   'data': data,
+                                   'message': {'message_id': update_id, 'date': int(time.time()),
+                                               'chat': {'id': user_id, 'type': 'private'}}}}
+
+    async def feed(self, update: dict, stats: LoadStats):
+        started = time.perf_counter()
+        with collect_spans() as spans:
+            try:
+                await self.dp.process_update(Update.to_object(update))
+            except Exception as e:
+                stats.errors += 1
+                logger.debug(e)
+        stats.latency.append(time.perf_counter() - started)
+        stats.db_queries.append(sum(1 for name, _, _ in spans if name.startswith('db ')))
+        stats.api_calls.append(sum(1 for name, _, _ in spans if name.startswith('bot_api ')))
+        stats.updates += 1
+
+    async def run_flow(self, user_id: int, stats: LoadStats):
+        self.api.keyboards.pop(user_id, None)
+        await self.feed(self.message_update(user_id, MAIN_MENU_TEXT), stats)
+        for _ in range(FLOW_DEPTH):
+            buttons = [button for button in self.api.keyboards.get(user_id, [])
+                       if json.loads(button['callback_data'])['action'] not in SKIPPED_ACTIONS]
+            if not buttons:
+                break
+            await asyncio.sleep(random.uniform(0, self.think_time))
+            self.api.keyboards.pop(user_id)
+            await self.feed(self.callback_update(user_id, random.choice(buttons)['callback_data']), stats)
+
+    async def run_user(self, user_id: int, flows: int, stats: LoadStats):
+        for _ in range(flows):
+            await self.run_flow(user_id, stats)
+
+
+def seed_catalog(journals: int, years: int, issues: int, articles: int):
+    current_year = datetime.now().year
+    with db.atomic():
+        for j in range(journals):
+            journal = Journal.create(symbol=f"j{j}", title=f"Журнал {j}", priority=j)
+            for year in range(current_year - years + 1, current_year + 1):
+                for number in range(1, issues + 1):
+                    issue = JournalIssue.create(journal=journal, year=year, number=number,
+                                                title=f"Выпуск {number}", annotation=f"Аннотация выпуска {number}",
+                                                link=f"/fixture/{journal.symbol}/{year}/{number}/")
+                    Article.insert_many([{'title': f"{journal.symbol} {year} №{number} статья {a}",
+                                          'url': f"{issue.link}{a}/",
+                                          'telegraph_path': f"fake-{issue.id}-{a}",
+                                          'journal_issue': issue,
+                                          'content_hash': ''} for a in range(articles)]).execute()
+
+
+def seed_users(count: int, first_id: int = 1000000):
+    User.delete().where(User.user_id >= first_id).execute()
+    with db.atomic():
+        for batch in range(0, count, 500):
+            User.insert_many([{'user_id': first_id + i, 'first_name': f"User {first_id + i}",
+                               'state': 'default', 'access': True}
+                              for i in range(batch, min(batch + 500, count))]).execute()
+    return [first_id + i for i in range(count)]
+
+
+async def run_level(users: VirtualUsers, user_ids: List[int], concurrency: int, flows: int) -> dict:
+    stats = LoadStats()
+    started = time.perf_counter()
+    await asyncio.gather(*(users.run_user(user_id, flows, stats) for user_id in user_ids[:concurrency]))
+    wall_time = time.perf_counter() - started
+    return {
+        'concurrency': concurrency,
+        'updates': stats.updates,
+        'errors': stats.errors,
+        'wall_time_s': wall_time,
+        'updates_per_sec': stats.updates / wall_time,
+        'latency_p50_ms': percentile(stats.latency, 50) * 1000,
+        'latency_p90_ms': percentile(stats.latency, 90) * 1000,
+        'latency_p99_ms': percentile(stats.latency, 99) * 1000,
+        'latency_max_ms': max(stats.latency, default=0) * 1000,
+        'db_queries_per_update': sum(stats.db_queries) / max(stats.updates, 1),
+        'api_calls_per_update': sum(stats.api_calls) / max(stats.updates, 1),
+    }
+
+
+async def run(args: argparse.Namespace, db_path: Path) -> List[dict]:
+    db.init(str(db_path))
+    init_db()
+    if args.db is None:
+        seed_catalog(args.journals, args.years, args.issues, args.articles)
+    user_ids = seed_users(max(args.concurrency))
+
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    runner = await api.start()
+    jw_bot.bot.server = TelegramAPIServer.from_base(api.base_url)
+    Bot.set_current(jw_bot.bot)
+    Dispatcher.set_current(jw_bot.dp)
+
+    users = VirtualUsers(jw_bot.dp, api, think_time=args.think_time / 1000)
+    levels = []
+    try:
+        for concurrency in args.concurrency:
+            level = await run_level(users, user_ids, concurrency, args.flows)
+            level['api_calls'] = dict(api.calls)
+            api.calls.clear()
+            levels.append(level)
+            print(f"concurrency {concurrency:>5}: {level['updates_per_sec']:8.1f} updates/s, "
+                  f"p50 {level['latency_p50_ms']:7.1f}ms, p99 {level['latency_p99_ms']:7.1f}ms, "
+                  f"{level['db_queries_per_update']:.1f} queries/update, "
+                  f"{level['api_calls_per_update']:.1f} API calls/update, errors: {level['errors']}")
+    finally:
+        await runner.cleanup()
+        await (await jw_bot.bot.get_session()).close()
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test: virtual users browsing the catalog')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100, 1000],
+                        help='simultaneous virtual users, one run per value')
+    parser.add_argument('--flows', type=int, default=3, help='navigation flows per user')
+    parser.add_argument('--think-time', type=float, default=0, help='max pause between clicks, ms')
+    parser.add_argument('--api-latency', type=float, default=0, help='fake Bot API latency, ms')
+    parser.add_argument('--db', type=Path, help='copy of a crawled db.sqlite3 instead of a generated catalog')
+    parser.add_argument('--journals', type=int, default=3)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--issues', type=int, default=12)
+    parser.add_argument('--articles', type=int, default=8)
+    parser.add_argument('--output', type=Path, help='save results as JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
+
+    with tempfile.TemporaryDirectory(prefix='jw_load_') as work_dir:
+        db_path = Path(work_dir) / 'load.sqlite3'
+        if args.db is not None:
+            shutil.copy(args.db, db_path)
+        levels = asyncio.get_event_loop().run_until_complete(run(args, db_path))
+
+    ceiling: Optional[dict] = max(levels, key=lambda level: level['updates_per_sec'], default=None)
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'config': {key: str(value) if isinstance(value, Path) else value
+                   for key, value in vars(args).items() if key != 'output'},
+        'throughput_ceiling': ceiling and {'updates_per_sec': ceiling['updates_per_sec'],
+                                           'concurrency': ceiling['concurrency']},
+        'levels': levels,
+    }
+    if ceiling:
+        print(f"Throughput ceiling: {ceiling['updates_per_sec']:.1f} updates/s "
+              f"at concurrency {ceiling['concurrency']}")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Языки каталога: пути jw.org, названия месяцев и разбор заголовков выпусков для каждого языка."""
+import re
+from typing import TYPE_CHECKING, Dict, Tuple
+
+if TYPE_CHECKING:  # bs4 нужен только краулеру, бот импортирует этот модуль ради названий языков
+    from bs4 import Tag
+
+
+class Locale:
+    def __init__(self, code: str, name: str, journals_path: str, months: Tuple[str, ...], issue_number_prefix: str):
+        self.code = code  # совпадает с contentLanguageFilter и префиксом пути на jw.org
+        self.name = name
+        self.journals_path = journals_path
+        self.months = months
+        self.issue_number_prefix = issue_number_prefix
+        self.issue_number_pattern = re.compile(
+            rf"(?P<number>(?<={re.escape(issue_number_prefix)}\s)\d+)\s(?P<year>\d{{4}})\s+\|\s(?P<title>.*)")
+
+    def month_to_number(self, month_name: str) -> int:
+        return self.months.index(month_name.lower()) + 1
+
+    def parse_journal_issue_title(self, title: 'Tag') -> Tuple[int, str, str]:
+        match = self.issue_number_pattern.search(title.text)
+
+        if match is None:
+            # &nbsp; symbol between month and year recognize as \S
+            match = re.search(r"(?P<month>\S*).(?P<year>\d{4})", title.text.strip())
+            month_number = self.month_to_number(match.group('month'))
+            title = title.find('span').text
+        else:
+            month_number = int(match.group('number'))
+            title = match.group('title')
+
+        year = match.group('year')
+
+        return month_number, year, title
+
+
+LOCALES: Dict[str, Locale] = {
+    'ru': Locale(code='ru',
+                 name='Русский',
+                 journals_path='/ru/публикации/журналы/',
+                 months=('январь', 'февраль', 'март', 'апрель', 'май', 'июнь',
+                         'июль', 'август', 'сентябрь', 'октябрь', 'ноябрь', 'декабрь'),
+                 issue_number_prefix='№'),
+    'en': Locale(code='en',
+                 name='English',
+                 journals_path='/en/library/magazines/',
+                 months=('january', 'february', 'march', 'april', 'may', 'june',
+                         'july', 'august', 'september', 'october', 'november', 'december'),
+                 issue_number_prefix='No.'),
+}
+DEFAULT_LANGUAGE = 'ru'
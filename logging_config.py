@@ -0,0 +1,24 @@
+import logging
+from logging import Logger
+from pathlib import Path
+from typing import Callable
+
+LOG_PATH = Path('./logs/log')
+LOG_FORMAT = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
+
+
+def setup_logging():
+    """Настраивает логирование в файл. Вызывается один раз из точки входа (bot.py или jw_watcher.py)."""
+    LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(level=logging.ERROR,
+                        format=LOG_FORMAT,
+                        datefmt='%m-%d %H:%M',
+                        filename=LOG_PATH)
+
+
+def log_failure(failure_logger: Logger, what: str) -> Callable:
+    """Done-callback для фоновых задач и futures: пишет в лог исключение, которым они завершились."""
+    def callback(future):
+        if not future.cancelled() and future.exception() is not None:
+            failure_logger.exception(f"{what} failed", exc_info=future.exception())
+    return callback
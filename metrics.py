@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+import config
+
+# настройки необязательны, их можно задать в config.py
+METRICS_HOST = getattr(config, 'METRICS_HOST', '127.0.0.1')  # /metrics слушает только локальный интерфейс
+METRICS_PORT = getattr(config, 'METRICS_PORT', 9108)  # бот
+WATCHER_METRICS_PORT = getattr(config, 'WATCHER_METRICS_PORT', 9109)  # краулер, запущенный отдельно
+TRACING_ENABLED = getattr(config, 'TRACING_ENABLED', False)  # если True -- в лог пишутся спаны каждого апдейта
+LOOP_LAG_INTERVAL = 1  # секунды между замерами задержки event loop
+
+logger = logging.getLogger('jw_bot.metrics')
+
+HANDLER_LATENCY = Histogram('jw_bot_handler_seconds', 'Bot handler latency', ['action'])
+HANDLER_ERRORS = Counter('jw_bot_handler_errors_total', 'Bot handler errors', ['action'])
+
+DB_QUERY_LATENCY = Histogram('jw_db_query_seconds', 'DB query duration', ['kind'])
+
+CRAWLER_STAGE_LATENCY = Histogram('jw_crawler_stage_seconds', 'Crawler stage duration', ['stage'],
+                                  buckets=(.1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+CRAWLER_ITEMS = Counter('jw_crawler_items_total', 'Items processed by crawler stage', ['stage'])
+CRAWLER_ERRORS = Counter('jw_crawler_errors_total', 'Crawler stage errors', ['stage'])
+
+HTTP_FETCH_LATENCY = Histogram('jw_http_fetch_seconds', 'HTTP fetch duration', ['host'])
+HTTP_FETCH_ERRORS = Counter('jw_http_fetch_errors_total', 'HTTP fetch errors', ['host'])
+
+TELEGRAPH_LATENCY = Histogram('jw_telegraph_request_seconds', 'Telegraph API latency', ['method'])
+TELEGRAPH_ERRORS = Counter('jw_telegraph_errors_total', 'Telegraph API errors', ['method'])
+
+BOT_API_LATENCY = Histogram('jw_bot_api_request_seconds', 'Telegram Bot API latency', ['method'])
+BOT_API_ERRORS = Counter('jw_bot_api_errors_total', 'Telegram Bot API errors', ['method'])
+
+EVENT_LOOP_LAG = Gauge('jw_event_loop_lag_seconds', 'Event loop lag')
+
+# спаны текущего апдейта: (имя, смещение от начала апдейта, длительность)
+_current_trace: ContextVar[Optional[List[Tuple[str, float, float]]]] = ContextVar('current_trace', default=None)
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    start_http_server(port, addr=host)
+    logger.info(f"Metrics are served on http://{host}:{port}/metrics")
+
+
+async def monitor_event_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    loop = asyncio.get_event_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.set(max(0.0, loop.time() - started - interval))
+
+
+def _record_span(name: str, started: float, duration: float):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.append((name, started, duration))
+
+
+@contextmanager
+def _observe(histogram: Histogram, errors: Optional[Counter], span_name: str, label: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors is not None:
+            errors.labels(label).inc()
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        histogram.labels(label).observe(duration)
+        _record_span(span_name, started, duration)
+
+
+@contextmanager
+def collect_spans():
+    """Собирает спаны всех запросов (БД, HTTP, Telegraph, Bot API), выполненных внутри блока.
+    Собранные спаны передаются и во внешний сборщик, если он есть.
+    """
+    spans = []
+    token = _current_trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+        parent = _current_trace.get()
+        if parent is not None:
+            parent.extend(spans)
+
+
+@contextmanager
+def trace_update(name: str):
+    """Пишет в лог одной записью спаны всех запросов, вызванных обработкой одного апдейта.
+    При выключенном TRACING_ENABLED ничего не делает.
+    """
+    if not TRACING_ENABLED:
+        yield
+        return
+
+    started = time.perf_counter()
+    with collect_spans() as spans:
+        try:
+            yield
+        finally:
+            total = time.perf_counter() - started
+            lines = [f"  {span_name}: +{(span_started - started) * 1000:.1f}ms, {duration * 1000:.1f}ms"
+                     for span_name, span_started, duration in spans]
+            logger.info(f"Trace {name}: {total * 1000:.1f}ms, {len(spans)} spans\n" + '\n'.join(lines))
+
+
+def observe_handler(action: str):
+    return _observe(HANDLER_LATENCY, HANDLER_ERRORS, f"handler {action}", action)
+
+
+def observe_db_query(sql: str):
+    kind = sql.split(None, 1)[0].upper() if sql.strip() else 'UNKNOWN'
+    return _observe(DB_QUERY_LATENCY, None, f"db {kind}", kind)
+
+
+def observe_http_fetch(url: str):
+    host = urlparse(url).hostname or 'unknown'
+    return _observe(HTTP_FETCH_LATENCY, HTTP_FETCH_ERRORS, f"http {host}", host)
+
+
+def observe_telegraph(method: str):
+    return _observe(TELEGRAPH_LATENCY, TELEGRAPH_ERRORS, f"telegraph {method}", method)
+
+
+def observe_bot_api(method: str):
+    return _observe(BOT_API_LATENCY, BOT_API_ERRORS, f"bot_api {method}", method)
+
+
+@contextmanager
+def crawler_stage(stage: str):
+    """Время этапа краулера; успешно завершённый этап увеличивает счётчик обработанных элементов."""
+    with _observe(CRAWLER_STAGE_LATENCY, CRAWLER_ERRORS, f"crawler {stage}", stage):
+        yield
+    CRAWLER_ITEMS.labels(stage).inc()
@@ -1,22 +1,66 @@
+import re
+from pathlib import Path
 from typing import Union
 
 from aiogram.types import Message, CallbackQuery
 from peewee import Model, SqliteDatabase, TextField, IntegerField, CompositeKey, CharField, ForeignKeyField, \
     BooleanField, PostgresqlDatabase, DoesNotExist
-from telegraph import Telegraph
+from playhouse.migrate import SqliteMigrator, migrate
 
 from config import TELEGRAPH_USER_TOKEN
+from locales import DEFAULT_LANGUAGE
+from metrics import observe_db_query
 
-db = SqliteDatabase('db.sqlite3')
+
+class InstrumentedSqliteDatabase(SqliteDatabase):
+    def execute_sql(self, sql, *args, **kwargs):
+        with observe_db_query(sql):
+            return super().execute_sql(sql, *args, **kwargs)
+
+
+db = InstrumentedSqliteDatabase('db.sqlite3')
 # db = PostgresqlDatabase()
 
+ROUTING_SQL_PATH = Path(__file__).parent / 'routing.sql'
+
 
 def init_db():
-    User.create_table(fail_silently=True)
-    Article.create_table(fail_silently=True)
-    Routing.create_table(fail_silently=True)
-    Journal.create_table(fail_silently=True)
-    JournalIssue.create_table(fail_silently=True)
+    """Создаёт таблицы и, если таблица роутинга пуста, заполняет её. Вызывается один раз при запуске."""
+    migrate_db()
+    db.create_tables([User, Article, Routing, Journal, JournalIssue, Image], safe=True)
+    if not Routing.select().exists():
+        init_routing()
+
+
+def migrate_db():
+    """Добавляет в базу, созданную до поддержки нескольких языков, колонки language у журналов и пользователей.
+    Уникальным становится обозначение журнала в пределах языка, а не по всей базе.
+    """
+    migrator = SqliteMigrator(db)
+    operations = []
+    for table, field in (('journal', Journal.language), ('user', User.language)):
+        if db.table_exists(table) and 'language' not in {column.name for column in db.get_columns(table)}:
+            operations.append(migrator.add_column(table, 'language', field))
+
+    if db.table_exists('journal'):
+        indexes = {index.name for index in db.get_indexes('journal')}
+        if 'journal_symbol' in indexes:
+            operations.append(migrator.drop_index('journal', 'journal_symbol'))
+        if 'journal_language_symbol' not in indexes:
+            operations.append(migrator.add_index('journal', ('language', 'symbol'), True))
+
+    if operations:
+        with db.atomic():
+            migrate(*operations)
+
+
+def init_routing():
+    route = ROUTING_SQL_PATH.read_text()
+    route = re.sub(r'\n', '', route)
+    route = re.sub(r'\s+', ' ', route)
+    with db.atomic():
+        db.execute_sql("DELETE FROM routing;")  # сначала очистим таблицу роутинга
+        db.execute_sql(route)
 
 
 class BaseModel(Model):
@@ -32,6 +76,7 @@ class User(BaseModel):
     state = TextField(default='default')
     access = BooleanField(default=False)
     access_msg_id = IntegerField(null=True)
+    language = CharField(max_length=5, default=DEFAULT_LANGUAGE)
 
     @classmethod
     def cog(cls, data: Union[Message, CallbackQuery]) -> 'User':
@@ -55,10 +100,16 @@ class ACL(BaseModel):  # Access Control List
 
 
 class Journal(BaseModel):
-    symbol = CharField(max_length=2, unique=True)
+    language = CharField(max_length=5, default=DEFAULT_LANGUAGE)
+    symbol = CharField(max_length=2)
     title = TextField()
     priority = IntegerField()
 
+    class Meta:
+        indexes = (
+            (('language', 'symbol'), True),  # обозначения журналов (w, g, wp) одинаковы во всех языках
+        )
+
 
 class JournalIssue(BaseModel):
     #  журнальный выпуск
@@ -84,6 +135,8 @@ class Article(BaseModel):
         return False
 
     def export_to_telegraph(self, content: str):
+        from telegraph import Telegraph
+
         telegraph = Telegraph(TELEGRAPH_USER_TOKEN)
 
         if self.is_changed():
@@ -95,6 +148,14 @@ class Article(BaseModel):
         print(telegraph_response)
 
 
+class Image(BaseModel):
+    #  изображение из статьи, загруженное в хранилище Telegraph. Одинаковые по содержимому изображения с разными
+    #  адресами ссылаются на один загруженный файл
+    source_url = TextField(unique=True)
+    content_hash = TextField(index=True)
+    telegraph_path = TextField()
+
+
 class Routing(BaseModel):
     state = TextField()
     decision = TextField()  # соответствует либо атрибуту data в инлайн кнопках,
@@ -0,0 +1,118 @@
+"""Профиль запуска бота.
+
+1. Время импорта bot.py по модулям (python -X importtime) и список тяжёлых модулей краулера, которые загрузились
+   вместе с ботом (в норме -- ни одного).
+2. Время до первого обработанного апдейта: импорт bot.py -> подготовка базы -> обработка сообщения «Главное меню»
+   от пользователя с доступом (Bot API -- локальный фейк из load_test.py).
+
+    python startup_profile.py --db db.sqlite3
+"""
+import argparse
+import asyncio
+import json
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+ROOT_DIR = Path(__file__).parent
+CRAWLER_MODULES = ('jw_watcher', 'common_functions', 'bs4', 'lxml', 'html5lib', 'telegraph')
+
+
+def import_profile(top: int) -> dict:
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                              f"import bot, sys; print(','.join(m for m in {CRAWLER_MODULES!r} if m in sys.modules))"],
+                             cwd=ROOT_DIR, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise SystemExit(process.stderr.splitlines()[-1])
+
+    modules = []
+    for line in process.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)', line)
+        if match:
+            modules.append({'module': match[4], 'self_ms': int(match[1]) / 1000,
+                            'cumulative_ms': int(match[2]) / 1000, 'depth': len(match[3])})
+
+    top_level = [module for module in modules if module['depth'] == 1]
+    return {
+        'total_ms': sum(module['cumulative_ms'] for module in top_level),
+        'top': sorted(modules, key=lambda module: module['cumulative_ms'], reverse=True)[:top],
+        'crawler_modules_loaded': [module for module in process.stdout.strip().split(',') if module],
+    }
+
+
+async def time_to_first_update(db_path: Path) -> dict:
+    started = time.perf_counter()
+    import bot as jw_bot
+    imported = time.perf_counter()
+
+    from models import db, init_db
+    db.init(str(db_path))
+    init_db()
+    db_ready = time.perf_counter()
+    crawler_modules: List[str] = [module for module in CRAWLER_MODULES if module in sys.modules]
+
+    from aiogram import Bot, Dispatcher
+    from aiogram.bot.api import TelegramAPIServer
+    from load_test import FakeBotAPI, LoadStats, VirtualUsers, seed_users, MAIN_MENU_TEXT
+
+    user_id = seed_users(1)[0]
+    api = FakeBotAPI(latency=0)
+    runner = await api.start()
+    jw_bot.bot.server = TelegramAPIServer.from_base(api.base_url)
+    Bot.set_current(jw_bot.bot)
+    Dispatcher.set_current(jw_bot.dp)
+    users = VirtualUsers(jw_bot.dp, api, think_time=0)
+    stats = LoadStats()
+    try:
+        update_started = time.perf_counter()
+        await users.feed(users.message_update(user_id, MAIN_MENU_TEXT), stats)
+        update_done = time.perf_counter()
+    finally:
+        await runner.cleanup()
+        await (await jw_bot.bot.get_session()).close()
+
+    return {
+        'import_bot_ms': (imported - started) * 1000,
+        'init_db_ms': (db_ready - imported) * 1000,
+        'first_update_ms': (update_done - update_started) * 1000,
+        'time_to_first_update_ms': (db_ready - started + update_done - update_started) * 1000,
+        'first_update_errors': stats.errors,
+        'crawler_modules_loaded_before_first_update': crawler_modules,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bot import time and time-to-first-update profile')
+    parser.add_argument('--db', type=Path, help='copy of db.sqlite3 to start on (default: empty database)')
+    parser.add_argument('--top', type=int, default=15, help='number of slowest imports to show')
+    parser.add_argument('--output', type=Path, help='save results as JSON')
+    args = parser.parse_args()
+
+    imports = import_profile(args.top)
+    print(f"import bot: {imports['total_ms']:.1f}ms")
+    for module in imports['top']:
+        print(f"  {module['cumulative_ms']:8.1f}ms  {module['module']}")
+    print(f"crawler modules imported with bot: {imports['crawler_modules_loaded'] or 'none'}")
+
+    with tempfile.TemporaryDirectory(prefix='jw_startup_') as work_dir:
+        db_path = Path(work_dir) / 'startup.sqlite3'
+        if args.db is not None:
+            shutil.copy(args.db, db_path)
+        startup = asyncio.get_event_loop().run_until_complete(time_to_first_update(db_path))
+
+    print(f"\nimport bot.py:         {startup['import_bot_ms']:8.1f}ms")
+    print(f"init_db:               {startup['init_db_ms']:8.1f}ms")
+    print(f"first update:          {startup['first_update_ms']:8.1f}ms")
+    print(f"time to first update:  {startup['time_to_first_update_ms']:8.1f}ms")
+
+    if args.output:
+        args.output.write_text(json.dumps({'imports': imports, 'startup': startup}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,5 +5,24 @@ STRESS = {
     'access_granted_btn': 'Доступ выдан. Нажмите чтобы изменить',
     'access_granted_msg': 'Вам выдан доступ. Теперь Вы можете пользоваться контентом бота.',
     'access_denied_btn': 'Вам выдан доступ. Теперь Вы можете пользоваться контентом бота.',
-    'access_denied_msg': 'Вам отказано в доступе.'
+    'access_denied_msg': 'Вам отказано в доступе.',
+    'select_language': 'Выберите язык / Choose a language:'
+}
+
+#  строки меню каталога на языке, выбранном пользователем
+MENU_STRESS = {
+    'ru': {
+        'select_journal': 'Какой журнал Вас интересует?',
+        'select_year': 'Выберите год:',
+        'select_issue': 'Выберите номер журнала:',
+        'select_article': 'Выберите статью:',
+        'language_btn': '🌐 Язык'
+    },
+    'en': {
+        'select_journal': 'Which magazine are you interested in?',
+        'select_year': 'Choose a year:',
+        'select_issue': 'Choose an issue:',
+        'select_article': 'Choose an article:',
+        'language_btn': '🌐 Language'
+    }
 }